@@ -0,0 +1,37 @@
+"""
+Shared Korean font setup for the PPT chart scripts.
+"""
+from __future__ import annotations
+import functools
+from typing import Optional
+
+import matplotlib.pyplot as plt
+import matplotlib.font_manager as fm
+
+KOREAN_FONT_CANDIDATES = (
+    'Malgun Gothic',     # Windows
+    'AppleGothic',       # macOS
+    'NanumGothic',       # Popular OSS font
+    'Noto Sans CJK KR',  # Google Noto
+    'Noto Sans CJK',
+)
+
+
+@functools.lru_cache(maxsize=1)
+def resolved_korean_family() -> Optional[str]:
+    """Return the first installed Korean font family (resolved once per process)."""
+    for name in KOREAN_FONT_CANDIDATES:
+        try:
+            # Uses matplotlib's cached font index; raises if the family is not registered
+            fm.findfont(fm.FontProperties(family=name), fallback_to_default=False)
+        except ValueError:
+            continue
+        return name
+    return None
+
+
+def set_korean_font():
+    fam = resolved_korean_family()
+    if fam:
+        plt.rcParams['font.family'] = fam
+    plt.rcParams['axes.unicode_minus'] = False
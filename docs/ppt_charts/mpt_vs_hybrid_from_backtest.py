@@ -3,8 +3,9 @@
 Generate a PPT-ready side-by-side comparison chart (MPT vs Hybrid) per training window
 by reusing the existing multi-window backtest code.
 
-It runs the backtest twice (MPT-only and Hybrid/QAOA+MPT) with the same
-tickers/windows/horizon/initial, then plots two bars per window.
+It runs the backtest twice (MPT-only and Hybrid/QAOA+MPT) in two worker
+processes with the same tickers/windows/horizon/initial, then plots two bars
+per window.
 
 Usage (examples):
   python docs/ppt_charts/mpt_vs_hybrid_from_backtest.py \
@@ -15,16 +16,28 @@ Usage (examples):
     --out docs/backtest/mpt_vs_hybrid_by_window.png
 
 If quantum libraries are not installed, the Hybrid run will fall back to MPT.
+
+Backtest results are cached under ~/.cache/qfn keyed by the run arguments, so
+re-running with the same inputs (e.g. while tweaking the plot) skips the
+download and optimization. Pass --no-cache to force a fresh run.
 """
 from __future__ import annotations
 import os
 import sys
 import argparse
-from typing import List
+import hashlib
+import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
 
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # File output only; skip GUI backend initialization
 import matplotlib.pyplot as plt
-import matplotlib.font_manager as fm
+
+plt.rcParams['path.simplify_threshold'] = 1.0
 
 
 def _ensure_path():
@@ -37,56 +50,53 @@ def _ensure_path():
 
 
 _ensure_path()
-from backtest_multi_window import run_backtest
-
-
-def _set_korean_font():
-    try_fonts = [
-        'Malgun Gothic',  # Windows
-        'AppleGothic',    # macOS
-        'NanumGothic',
-        'Noto Sans CJK KR',
-        'Noto Sans CJK',
-    ]
-    available = {f.name for f in fm.fontManager.ttflist}
-    for f in try_fonts:
-        if f in available:
-            plt.rcParams['font.family'] = f
-            break
-    plt.rcParams['axes.unicode_minus'] = False
-
-
-def build_chart(tickers: List[str], windows: List[str], horizon: str, initial: float, out_path: str):
-    # Run MPT-only (fast)
-    mpt_res = run_backtest(tickers, windows, horizon, float(initial), use_qaoa_hybrid=False)
-
-    # Run Hybrid (QAOA+MPT; will fall back to MPT if quantum libs missing)
-    hybrid_res = run_backtest(tickers, windows, horizon, float(initial), use_qaoa_hybrid=True)
-
-    # Prepare data aligned by window
-    mpt_vals = []
-    hyb_vals = []
-    aligned_windows = []
-    for w in windows:
-        if w not in mpt_res['results']['details'] or w not in hybrid_res['results']['details']:
-            # Skip window if either run had missing data
-            continue
-        mpt_series = mpt_res['results']['details'][w]['investment_series']
-        hyb_series = hybrid_res['results']['details'][w]['investment_series']
-        mpt_vals.append(float(mpt_series.iloc[-1]))
-        hyb_vals.append(float(hyb_series.iloc[-1]))
-        aligned_windows.append(w)
-
-    if not aligned_windows:
-        raise RuntimeError('No windows produced valid results in both runs.')
-
-    # Plot
-    _set_korean_font()
+from backtest_multi_window import run_backtest, prepare_training_stats
+from chart_fonts import set_korean_font
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'qfn')
+
+# run_backtest's default chart folder
+BACKTEST_CHART_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backtest'))
+
+
+def _cache_path(tickers: List[str], windows: List[str], horizon: str, initial: float, use_qaoa_hybrid: bool) -> str:
+    # Include today's date: run_backtest anchors its windows on datetime.now()
+    today = datetime.now().strftime('%Y-%m-%d')
+    key = hashlib.blake2b(repr((sorted(tickers), tuple(windows), horizon, float(initial), use_qaoa_hybrid, today)).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f'bt_{key}.pkl')
+
+
+def cached_run_backtest(tickers: List[str], windows: List[str], horizon: str, initial: float,
+                        use_qaoa_hybrid: bool, use_cache: bool = True,
+                        precomputed: Optional[Dict[str, Dict]] = None,
+                        out_dir: Optional[str] = None) -> Dict:
+    """run_backtest wrapper with an on-disk pickle cache.
+
+    Only the final portfolio value per window is kept, since that is all the
+    chart needs; this keeps cache entries small.
+    """
+    cache_path = _cache_path(tickers, windows, horizon, initial, use_qaoa_hybrid)
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            pass  # Corrupt/stale entry: recompute below
+
+    res = run_backtest(tickers, windows, horizon, float(initial), use_qaoa_hybrid=use_qaoa_hybrid,
+                       precomputed=precomputed, return_series=False, out_dir=out_dir)
+    slim = {'results': {'details': res['results']['details']}}
+    if use_cache:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(cache_path, 'wb') as f:
+            pickle.dump(slim, f)
+    return slim
+
+
+def _render(ax, aligned_windows: List[str], mpt_vals: np.ndarray, hyb_vals: np.ndarray, horizon: str, initial: float):
     x = np.arange(len(aligned_windows))
     width = 0.35
 
-    fig, ax = plt.subplots(figsize=(14, 7))
-
     bars_mpt = ax.bar(x - width/2, mpt_vals, width, label='MPT', color='#6aa84f', edgecolor='#2d5a27', linewidth=1.2)
     bars_hyb = ax.bar(x + width/2, hyb_vals, width, label='하이브리드(QAOA+MPT)', color='#4a76ff', edgecolor='#2649a4', linewidth=1.2)
 
@@ -99,19 +109,71 @@ def build_chart(tickers: List[str], windows: List[str], horizon: str, initial: f
     ax.legend(loc='upper left')
 
     # Annotate values and ROI
-    def _roi(v):
-        return (v / initial - 1.0) * 100.0
-    ymax = max(max(mpt_vals), max(hyb_vals)) * 1.10
+    rois_mpt = (mpt_vals / initial - 1.0) * 100.0
+    rois_hyb = (hyb_vals / initial - 1.0) * 100.0
+    ymax = max(mpt_vals.max(), hyb_vals.max()) * 1.10
     ax.set_ylim(0, ymax)
-    for b, v in zip(bars_mpt, mpt_vals):
-        ax.text(b.get_x() + b.get_width()/2, v * 1.01, f'${v:,.0f}\n({_roi(v):+.1f}%)', ha='center', va='bottom', fontsize=10)
-    for b, v in zip(bars_hyb, hyb_vals):
-        ax.text(b.get_x() + b.get_width()/2, v * 1.01, f'${v:,.0f}\n({_roi(v):+.1f}%)', ha='center', va='bottom', fontsize=10)
+    labels_mpt = [f'${v:,.0f}\n({r:+.1f}%)' for v, r in zip(mpt_vals, rois_mpt)]
+    labels_hyb = [f'${v:,.0f}\n({r:+.1f}%)' for v, r in zip(hyb_vals, rois_hyb)]
+    ax.bar_label(bars_mpt, labels=labels_mpt, padding=3, fontsize=10)
+    ax.bar_label(bars_hyb, labels=labels_hyb, padding=3, fontsize=10)
+
+
+def build_chart(tickers: List[str], windows: List[str], horizon: str, initial: float, out_path: str,
+                use_cache: bool = True, fig=None, ax=None):
+    """Backtest MPT vs Hybrid and save the comparison chart to out_path.
+
+    fig/ax: optional preallocated figure/axes. When given, the axes are cleared
+    and reused instead of creating (and closing) a new figure, so a sweep driver
+    can render many charts on one canvas and close it once at the end.
+    """
+    # Download training prices and estimate mu/Sigma once for both runs
+    # (skipped when both results are already cached)
+    precomputed = None
+    if not (use_cache and all(os.path.exists(_cache_path(tickers, windows, horizon, initial, mode))
+                              for mode in (False, True))):
+        precomputed = prepare_training_stats(tickers, windows, horizon)
+
+    # Run MPT-only and Hybrid (QAOA+MPT; falls back to MPT if quantum libs missing)
+    # in parallel. run_backtest writes fixed chart file names, so the MPT run gets
+    # its own folder; the Hybrid run keeps the default docs/backtest charts.
+    # Workers are spawned, not forked, so they do not inherit the yfinance HTTP
+    # session (and its open connections) used by prepare_training_stats above.
+    mpt_chart_dir = os.path.join(BACKTEST_CHART_DIR, 'mpt')
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn')) as pool:
+        mpt_fut = pool.submit(cached_run_backtest, tickers, windows, horizon, float(initial), False, use_cache,
+                              precomputed, mpt_chart_dir)
+        hybrid_fut = pool.submit(cached_run_backtest, tickers, windows, horizon, float(initial), True, use_cache,
+                                 precomputed)
+        mpt_res = mpt_fut.result()
+        hybrid_res = hybrid_fut.result()
+
+    # Prepare data aligned by window (skip windows where either run had missing data)
+    mpt_details = mpt_res['results']['details']
+    hyb_details = hybrid_res['results']['details']
+    aligned_windows = [w for w in windows if w in mpt_details and w in hyb_details]
+    n_aligned = len(aligned_windows)
+    mpt_vals = np.fromiter((mpt_details[w]['final_value'] for w in aligned_windows), dtype=np.float64, count=n_aligned)
+    hyb_vals = np.fromiter((hyb_details[w]['final_value'] for w in aligned_windows), dtype=np.float64, count=n_aligned)
+
+    if not aligned_windows:
+        raise RuntimeError('No windows produced valid results in both runs.')
 
-    plt.tight_layout()
+    # Plot (reuse the caller's axes when given, e.g. from a parameter sweep)
+    set_korean_font()
+    own_fig = ax is None
+    if own_fig:
+        fig, ax = plt.subplots(figsize=(14, 7))
+    else:
+        fig = fig if fig is not None else ax.figure
+        ax.cla()
+    _render(ax, aligned_windows, mpt_vals, hyb_vals, horizon, initial)
+
+    fig.tight_layout()
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    plt.savefig(out_path, dpi=160)
-    plt.close(fig)
+    fig.savefig(out_path, dpi=120, bbox_inches='tight')
+    if own_fig:
+        plt.close(fig)
 
     # Simple console summary
     try:
@@ -119,8 +181,8 @@ def build_chart(tickers: List[str], windows: List[str], horizon: str, initial: f
         print(json.dumps({
             'out': os.path.abspath(out_path),
             'windows': aligned_windows,
-            'mpt': mpt_vals,
-            'hybrid': hyb_vals,
+            'mpt': mpt_vals.tolist(),
+            'hybrid': hyb_vals.tolist(),
         }))
     except Exception:
         pass
@@ -133,9 +195,10 @@ def main():
     p.add_argument('--horizon', required=False, default='3mo')
     p.add_argument('--initial', type=float, required=False, default=10000.0)
     p.add_argument('--out', required=False, default=os.path.join('docs', 'backtest', 'mpt_vs_hybrid_by_window.png'))
+    p.add_argument('--no-cache', action='store_true', help='Ignore and do not write cached backtest results')
     args = p.parse_args()
 
-    build_chart(args.tickers, args.windows, args.horizon, args.initial, args.out)
+    build_chart(args.tickers, args.windows, args.horizon, args.initial, args.out, use_cache=not args.no_cache)
 
 
 if __name__ == '__main__':
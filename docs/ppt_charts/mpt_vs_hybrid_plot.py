@@ -3,22 +3,44 @@ import math
 import os
 from typing import Optional
 
+import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # File output only; skip GUI backend initialization
 import matplotlib.pyplot as plt
-from matplotlib import font_manager
+
+from chart_fonts import set_korean_font
+
+plt.rcParams['path.simplify_threshold'] = 1.0
 
 
 DEF_OUTPUT = os.path.join(os.path.dirname(__file__), '..', 'backtest', 'mpt_vs_hybrid_3mo.png')
 DEF_INPUT = os.path.join(os.path.dirname(__file__), '..', 'data', 'mpt_vs_hybrid_3mo.csv')
 
 
+# Expected columns: window_label, mpt_final_value, hybrid_final_value, initial_investment
+COLUMN_DTYPES = {
+    'mpt_final_value': 'float64',
+    'hybrid_final_value': 'float64',
+    'initial_investment': 'float64',
+    'window_label': 'string',
+}
+
+
 def load_data(csv_path: str) -> pd.DataFrame:
-    df = pd.read_csv(csv_path)
-    # Expected columns: window_label, mpt_final_value, hybrid_final_value, initial_investment
-    # Coerce numerics
-    for col in ['mpt_final_value', 'hybrid_final_value', 'initial_investment']:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
+    # Type columns at read time (only those present) instead of coercing afterwards
+    present = pd.read_csv(csv_path, nrows=0).columns
+    dtypes = {col: dt for col, dt in COLUMN_DTYPES.items() if col in present}
+    try:
+        df = pd.read_csv(csv_path, dtype=dtypes, na_values=['', 'NA'], engine='c')
+    except ValueError:
+        # Placeholder cells (e.g. '-') in a numeric column: read those columns
+        # untyped and coerce unparseable values to NaN
+        numeric = [col for col, dt in dtypes.items() if dt == 'float64']
+        text_dtypes = {col: dt for col, dt in dtypes.items() if col not in numeric}
+        df = pd.read_csv(csv_path, dtype=text_dtypes, na_values=['', 'NA'], engine='c')
+        for col in numeric:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
     if 'window_label' not in df.columns:
         df['window_label'] = [f'win_{i+1}' for i in range(len(df))]
     return df
@@ -52,19 +74,7 @@ def compute_summary(df: pd.DataFrame) -> Optional[dict]:
 
 
 def _setup_korean_font():
-    # Try common Korean fonts on Windows/macOS/Linux. Fallback to default if none found.
-    candidates = [
-        'Malgun Gothic',        # Windows default Korean
-        'NanumGothic',          # Popular OSS font
-        'Noto Sans CJK KR',     # Google Noto
-        'AppleGothic',          # macOS
-    ]
-    installed = set(f.name for f in font_manager.fontManager.ttflist)
-    for name in candidates:
-        if name in installed:
-            plt.rcParams['font.family'] = name
-            break
-    plt.rcParams['axes.unicode_minus'] = False
+    set_korean_font()
     plt.rcParams['font.size'] = 11
 
 
@@ -73,27 +83,33 @@ def plot(df: pd.DataFrame, out_path: str):
 
     has_mpt = 'mpt_final_value' in df.columns and df['mpt_final_value'].notna().any()
     windows = df['window_label'].astype(str).tolist()
-    x = range(len(windows))
+    x = np.arange(len(windows))
+
+    # Label offsets scale with the tallest hybrid bar; compute once
+    hyb_max = float(df['hybrid_final_value'].max())
+    y_offset_bar = max(hyb_max * 0.01, 10.0)
+    y_offset_init = max(hyb_max * 0.008, 5.0)
 
     width = 0.35 if has_mpt else 0.5
     fig, ax = plt.subplots(figsize=(12, 6))
 
     # Bars
     if has_mpt:
-        ax.bar([i - width/2 for i in x], df['mpt_final_value'], width=width, label='MPT', color='#94a3b8', edgecolor='#334155')
-        ax.bar([i + width/2 for i in x], df['hybrid_final_value'], width=width, label='하이브리드 (MPT+QAOA)', color='#60a5fa', edgecolor='#1e40af')
+        ax.bar(x - width/2, df['mpt_final_value'], width=width, label='MPT', color='#94a3b8', edgecolor='#334155')
+        ax.bar(x + width/2, df['hybrid_final_value'], width=width, label='하이브리드 (MPT+QAOA)', color='#60a5fa', edgecolor='#1e40af')
     else:
         ax.bar(x, df['hybrid_final_value'], width=width, label='하이브리드 (MPT+QAOA)', color='#60a5fa', edgecolor='#1e40af')
 
     # Value labels
     def annotate(values, xs):
-        for xv, yv in zip(xs, values):
-            if pd.notna(yv):
-                ax.text(xv, yv + max(df['hybrid_final_value'].max()*0.01, 10), f"${yv:,.0f}", ha='center', va='bottom', fontsize=9)
+        vals = values.to_numpy(dtype=np.float64)
+        keep = ~np.isnan(vals)
+        for xv, yv in zip(xs[keep], vals[keep]):
+            ax.text(xv, yv + y_offset_bar, f"${yv:,.0f}", ha='center', va='bottom', fontsize=9)
 
     if has_mpt:
-        annotate(df['mpt_final_value'], [i - width/2 for i in x])
-        annotate(df['hybrid_final_value'], [i + width/2 for i in x])
+        annotate(df['mpt_final_value'], x - width/2)
+        annotate(df['hybrid_final_value'], x + width/2)
     else:
         annotate(df['hybrid_final_value'], x)
 
@@ -108,7 +124,7 @@ def plot(df: pd.DataFrame, out_path: str):
     if 'initial_investment' in df.columns and df['initial_investment'].notna().any():
         init = float(df['initial_investment'].dropna().iloc[0])
         ax.axhline(init, color='red', linestyle='--', linewidth=1)
-        ax.text(len(x)-0.5, init + max(df['hybrid_final_value'].max()*0.008, 5), f'초기 투자금: ${init:,.0f}', color='red')
+        ax.text(len(x)-0.5, init + y_offset_init, f'초기 투자금: ${init:,.0f}', color='red')
 
     ax.legend()
     if not has_mpt:
@@ -118,7 +134,7 @@ def plot(df: pd.DataFrame, out_path: str):
     fig.tight_layout()
 
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    plt.savefig(out_path, dpi=180)
+    plt.savefig(out_path, dpi=120, bbox_inches='tight')
     print(f"Saved chart to: {out_path}")
 
 
@@ -24,7 +24,7 @@ import math
 import argparse
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional
 
 import numpy as np
 import pandas as pd
@@ -129,16 +129,48 @@ def portfolio_cumulative_value(weights: np.ndarray, prices: pd.DataFrame, initia
 # Backtest core
 # ----------------------------
 
+def prepare_training_stats(symbols: List[str], windows: List[str], investment_horizon: str) -> Dict[str, Dict]:
+    """Download training prices and compute annualized stats once per window.
+
+    The result can be passed to run_backtest(precomputed=...) so several runs
+    over the same inputs (e.g. MPT and Hybrid) share one download/estimate.
+    Windows without data are omitted.
+    """
+    invest_start = datetime.now() - parse_window(investment_horizon)
+    prepared: Dict[str, Dict] = {}
+    for w in windows:
+        train_start = invest_start - parse_window(w)
+        prices_train = download_close(symbols, start=train_start.strftime('%Y-%m-%d'), end=invest_start.strftime('%Y-%m-%d'))
+        if prices_train.empty:
+            continue
+        mu, cov = annualized_stats(prices_train)
+        prepared[w] = {'mu': mu, 'Sigma': cov, 'prices': prices_train}
+    return prepared
+
+
 def run_backtest(symbols: List[str], windows: List[str], investment_horizon: str, initial: float,
                  use_qaoa_hybrid: bool = True,
-                 diversify_bounds: Tuple[float, float] = (0.05, 0.40)) -> Dict:
+                 diversify_bounds: Tuple[float, float] = (0.05, 0.40),
+                 precomputed: Optional[Dict[str, Dict]] = None,
+                 return_series: bool = True,
+                 out_dir: Optional[str] = None) -> Dict:
+    """Run the multi-window backtest and write the charts.
+
+    precomputed: optional output of prepare_training_stats(); windows found in it
+    reuse the given prices/mu/Sigma instead of downloading and re-estimating.
+    return_series: if False, results['details'][w] only holds {'final_value': float}
+    instead of the full series/prices (much smaller to pickle across processes).
+    out_dir: chart output folder (default docs/backtest); concurrent runs must
+    use different folders since the chart file names are fixed.
+    """
     now = datetime.now()
     horizon_delta = parse_window(investment_horizon)
     invest_start = now - horizon_delta
     invest_end = now
 
     # Prepare folder
-    out_dir = os.path.join(os.path.dirname(CURRENT_DIR), '..', '..', 'docs', 'backtest')
+    if out_dir is None:
+        out_dir = os.path.join(os.path.dirname(CURRENT_DIR), '..', '..', 'docs', 'backtest')
     out_dir = os.path.abspath(out_dir)
     os.makedirs(out_dir, exist_ok=True)
 
@@ -169,14 +201,18 @@ def run_backtest(symbols: List[str], windows: List[str], investment_horizon: str
         train_start = invest_start - lookback_delta
         train_end = invest_start
 
-        prices_train = download_close(symbols, start=train_start.strftime('%Y-%m-%d'), end=train_end.strftime('%Y-%m-%d'))
-        if prices_train.empty:
-            print(f"[WARN] No training data for window {w}", file=sys.stderr)
-            continue
+        if precomputed is not None and w in precomputed:
+            prices_train = precomputed[w]['prices'].copy()
+            mu, cov = precomputed[w]['mu'], precomputed[w]['Sigma']
+        else:
+            prices_train = download_close(symbols, start=train_start.strftime('%Y-%m-%d'), end=train_end.strftime('%Y-%m-%d'))
+            if prices_train.empty:
+                print(f"[WARN] No training data for window {w}", file=sys.stderr)
+                continue
+            mu, cov = annualized_stats(prices_train)
         if isinstance(prices_train, pd.DataFrame) and prices_train.shape[1] == len(display_names):
             prices_train.columns = display_names
 
-        mu, cov = annualized_stats(prices_train)
         n = len(symbols)
         risk_factor = 0.5  # balanced
 
@@ -382,6 +418,12 @@ def run_backtest(symbols: List[str], windows: List[str], investment_horizon: str
         print(f"   {w} 학습: ${profit:,.0f} (Equal 대비 {improvement:+,.0f}, {improvement/equal_profit_per_window*100:+.1f}%)")
     print(f"   평균 추가 수익: ${avg_improvement:,.0f} ({avg_improvement/equal_profit_per_window*100:+.1f}%)")
 
+    if not return_series:
+        results['details'] = {
+            w: {'final_value': float(det['investment_series'].iloc[-1])}
+            for w, det in results['details'].items()
+        }
+
     return {
         'output_dir': out_dir,
         'value_chart': fp,
@@ -4,28 +4,74 @@ Portfolio Optimization using Modern Portfolio Theory and Quantum Algorithms
 Optimizes stock portfolio allocation based on risk and return
 """
 
+import functools
 import json
+import os
 import sys
 import numpy as np
 from datetime import datetime
+import threading
 import time
 
 # Quantum computing imports
 try:
     from qiskit import QuantumCircuit
     from qiskit.primitives import StatevectorSampler as Sampler
-    from qiskit_algorithms import QAOA, VQE
+    from qiskit_algorithms.minimum_eigensolvers import SamplingVQE
     from qiskit_algorithms.optimizers import COBYLA, SLSQP
     from qiskit_optimization import QuadraticProgram
     from qiskit_optimization.algorithms import MinimumEigenOptimizer
     from qiskit_optimization.converters import QuadraticProgramToQubo
-    from qiskit.circuit.library import TwoLocal
+    from qiskit.circuit.library import QAOAAnsatz, TwoLocal
     QUANTUM_AVAILABLE = True
     print("✅ Quantum computing libraries loaded successfully", file=sys.stderr)
 except ImportError as e:
     QUANTUM_AVAILABLE = False
     print(f"Warning: Qiskit not available. Quantum algorithms disabled. Error: {e}", file=sys.stderr)
 
+# Classical optimization (imported once here rather than on every optimize call)
+try:
+    from scipy.optimize import minimize
+    from scipy.linalg import cho_factor, cho_solve, cholesky
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+# Market data for real returns and backtesting
+try:
+    import yfinance as yf
+    import pandas as pd
+    from dateutil.relativedelta import relativedelta
+    MARKET_DATA_AVAILABLE = True
+except ImportError:
+    MARKET_DATA_AVAILABLE = False
+
+# Lower bound on portfolio risk used as a Sharpe-ratio denominator
+RISK_EPSILON = 1e-12
+
+# QUBOs up to this many binary variables are solved exactly by enumeration
+# (2**20 bitstrings take well under a second, less than quantum setup alone)
+CLASSICAL_QUBO_MAX_BITS = 20
+
+# Largest QAOA/VQE problem attempted on the statevector sampler (2**30 amplitudes);
+# bigger portfolios go straight to MPT
+QUANTUM_MAX_QUBITS = 30
+
+
+def _sharpe_neg(w, returns, LT, risk_free_rate):
+    """Negative Sharpe ratio of weights w, with Sigma = L L^T (LT = L^T)"""
+    Lw = LT @ w
+    safe_risk = max(np.sqrt(Lw @ Lw), RISK_EPSILON)
+    return -(w @ returns - risk_free_rate) / safe_risk
+
+
+def _sharpe_neg_jac(w, returns, L, LT, risk_free_rate):
+    """Gradient of _sharpe_neg with respect to w"""
+    Lw = LT @ w
+    safe_risk = max(np.sqrt(Lw @ Lw), RISK_EPSILON)
+    Sw = L @ Lw
+    return -(returns / safe_risk - (w @ returns - risk_free_rate) * Sw / safe_risk**3)
+
 
 def load_input_data(input_file):
     """Load optimization request data from JSON file"""
@@ -33,6 +79,44 @@ def load_input_data(input_file):
         return json.load(f)
 
 
+def calculate_annualized_stats(prices, shrinkage=False):
+    """
+    Annualized mean returns and covariance (252 trading days) from a
+    (days x stocks) close-price array, computed directly in NumPy.
+    Matches ffill().pct_change().dropna() on the equivalent DataFrame.
+    
+    shrinkage: use the Ledoit-Wolf estimator (well-conditioned even when the
+    number of days is close to the number of stocks) if scikit-learn is installed;
+    imported here rather than at module scope since it takes about a second to load
+    """
+    P = np.asarray(prices, dtype=np.float64)
+    if P.ndim == 1:
+        P = P[:, None]
+    
+    # Forward-fill missing prices (e.g. market holidays) column by column
+    missing = np.isnan(P)
+    if missing.any():
+        last_valid = np.where(missing, 0, np.arange(P.shape[0])[:, None])
+        np.maximum.accumulate(last_valid, axis=0, out=last_valid)
+        P = P[last_valid, np.arange(P.shape[1])]
+    
+    # Daily simple returns; drop rows that are still undefined (leading gaps)
+    R = np.diff(P, axis=0) / P[:-1]
+    R = R[np.isfinite(R).all(axis=1)]
+    if R.shape[0] < 2:
+        raise ValueError("Not enough price data to compute returns")
+    
+    mean_returns = R.mean(axis=0) * 252
+    if shrinkage:
+        try:
+            from sklearn.covariance import LedoitWolf
+            return mean_returns, LedoitWolf().fit(R).covariance_ * 252
+        except ImportError:
+            pass
+    cov_matrix = np.atleast_2d(np.cov(R, rowvar=False)) * 252
+    return mean_returns, cov_matrix
+
+
 def fetch_real_historical_data(stocks, period='1y', use_real_data=True):
     """
     Fetch REAL historical stock data using yfinance
@@ -41,10 +125,11 @@ def fetch_real_historical_data(stocks, period='1y', use_real_data=True):
     if not use_real_data:
         return fetch_simulated_data(stocks)
     
+    if not MARKET_DATA_AVAILABLE:
+        print("Warning: yfinance/pandas not available, falling back to simulation", file=sys.stderr)
+        return fetch_simulated_data(stocks)
+    
     try:
-        import yfinance as yf
-        import pandas as pd
-        
         print(f"Fetching real data for {len(stocks)} stocks, period: {period}...", file=sys.stderr)
         
         # Get stock symbols
@@ -57,25 +142,12 @@ def fetch_real_historical_data(stocks, period='1y', use_real_data=True):
             print("Warning: No data fetched, falling back to simulation", file=sys.stderr)
             return fetch_simulated_data(stocks)
         
-        # Calculate daily returns
-        if len(symbols) == 1:
-            prices = data['Close']
-            returns_data = prices.pct_change().dropna()
-            mean_returns = np.array([returns_data.mean() * 252])  # Annualized
-            cov_matrix = np.array([[returns_data.std() ** 2 * 252]])  # Annualized
-        else:
-            prices = data['Close']
-            returns_data = prices.pct_change().dropna()
-            
-            # Annualized returns (252 trading days)
-            mean_returns = returns_data.mean() * 252
-            
-            # Annualized covariance matrix
-            cov_matrix = returns_data.cov() * 252
-            
-            # Convert to numpy arrays
-            mean_returns = mean_returns.values
-            cov_matrix = cov_matrix.values
+        # Annualized returns and covariance from daily close prices
+        prices = data['Close'].to_numpy(dtype=np.float64, copy=False)
+        mean_returns, cov_matrix = calculate_annualized_stats(prices, shrinkage=True)
+        
+        mean_returns = np.ascontiguousarray(mean_returns, dtype=np.float64)
+        cov_matrix = np.ascontiguousarray(cov_matrix, dtype=np.float64)
         
         print(f"✅ Real data fetched successfully", file=sys.stderr)
         print(f"Mean returns: {mean_returns}", file=sys.stderr)
@@ -96,25 +168,24 @@ def fetch_simulated_data(stocks):
     n_stocks = len(stocks)
     
     # Fix random seed for consistent results based on stock symbols
-    seed = sum([ord(c) for stock in stocks for c in stock['symbol']]) % 10000
-    np.random.seed(seed)
+    seed = sum(ord(c) for stock in stocks for c in stock['symbol']) % 10000
+    rng = np.random.default_rng(seed)
     
     # Simulate returns based on risk levels
-    returns = []
-    for stock in stocks:
-        risk = stock['riskLevel']
-        expected_return = 0.05 + (risk / 100.0) * 0.15
-        returns.append(expected_return)
-    
-    returns = np.array(returns)
+    # Missing/None riskLevel defaults to 5.0 (as in _split_stocks) so NaN never reaches the optimizer
+    risk_levels = np.array(
+        [5.0 if stock.get('riskLevel') is None else stock['riskLevel'] for stock in stocks],
+        dtype=np.float64
+    )
+    returns = 0.05 + (risk_levels / 100.0) * 0.15
     
     # Generate covariance matrix based on risk levels
-    volatility = np.array([stock['riskLevel'] / 100.0 * 0.3 for stock in stocks])
-    correlation_matrix = np.random.uniform(0.3, 0.7, (n_stocks, n_stocks))
+    volatility = risk_levels / 100.0 * 0.3
+    correlation_matrix = rng.uniform(0.3, 0.7, (n_stocks, n_stocks))
+    correlation_matrix = 0.5 * (correlation_matrix + correlation_matrix.T)
     np.fill_diagonal(correlation_matrix, 1.0)
-    correlation_matrix = (correlation_matrix + correlation_matrix.T) / 2
     
-    covariance_matrix = np.outer(volatility, volatility) * correlation_matrix
+    covariance_matrix = np.ascontiguousarray((volatility[:, None] * volatility[None, :]) * correlation_matrix)
     
     return returns, covariance_matrix
 
@@ -135,6 +206,9 @@ def build_portfolio_optimization_problem(returns, covariance_matrix, risk_factor
         raise ValueError("Returns data is empty or None")
     if covariance_matrix is None:
         raise ValueError("Covariance matrix is None")
+    # Normalize layout once so every downstream dot/einsum/solve hits the BLAS fast path
+    returns = np.ascontiguousarray(returns, dtype=np.float64)
+    covariance_matrix = np.ascontiguousarray(covariance_matrix, dtype=np.float64)
     n = len(returns)
     return n, returns, covariance_matrix, risk_factor
 
@@ -146,14 +220,17 @@ def optimize_with_modern_portfolio_theory(n, returns, covariance_matrix, risk_fa
     
     constraints: dict with 'min_weights' and 'max_weights' arrays
     """
+    # Single stock: the only feasible long-only portfolio is 100% in it
+    if n == 1:
+        return np.array([1.0])
+    
+    if not SCIPY_AVAILABLE:
+        print("Warning: scipy not available, using equal weights", file=sys.stderr)
+        return np.ones(n) / n
+    
     try:
-        from scipy.optimize import minimize
-        
         # If no constraints, use simple analytical solution
         if constraints is None:
-            # Calculate inverse covariance matrix
-            inv_cov = np.linalg.inv(covariance_matrix)
-            
             # Optimal weights with risk aversion parameter
             ones = np.ones(n)
             
@@ -162,8 +239,17 @@ def optimize_with_modern_portfolio_theory(n, returns, covariance_matrix, risk_fa
             # where lambda is risk aversion coefficient
             risk_aversion = 2.0 / risk_factor if risk_factor > 0 else 1.0
             
-            # Calculate optimal weights
-            weights = np.dot(inv_cov, returns) / risk_aversion
+            # Diagonal loading (Tikhonov) keeps a singular PSD Sigma (few samples,
+            # duplicated tickers) positive definite, so the Cholesky solve stays valid
+            diag_load = 1e-8 * np.trace(covariance_matrix) / n
+            cov_reg = covariance_matrix + diag_load * np.eye(n)
+            
+            # Calculate optimal weights: solve Sigma x = mu rather than forming Sigma^-1
+            # (Cholesky; LU if Sigma is indefinite, e.g. simulated correlations)
+            try:
+                weights = cho_solve(cho_factor(cov_reg), returns) / risk_aversion
+            except np.linalg.LinAlgError:
+                weights = np.linalg.solve(cov_reg, returns) / risk_aversion
             
             # Normalize to sum to 1
             if weights.sum() > 0:
@@ -181,20 +267,33 @@ def optimize_with_modern_portfolio_theory(n, returns, covariance_matrix, risk_fa
         min_weights = constraints.get('min_weights', np.zeros(n))
         max_weights = constraints.get('max_weights', np.ones(n))
         
-        # Objective function: maximize Sharpe ratio (minimize negative Sharpe)
+        mu = np.ascontiguousarray(returns, dtype=np.float64)
+        cov = np.ascontiguousarray(covariance_matrix, dtype=np.float64)
+        risk_free_rate = 0.02
+        
+        # Sigma is constant for the whole solve: factor it once (Sigma = L L^T)
+        # so each evaluation is one triangular matvec instead of a full Sigma @ w
+        try:
+            L = cholesky(cov, lower=True)
+        except np.linalg.LinAlgError:
+            # Not positive definite: use the PSD square-root factor instead
+            eigvals, eigvecs = np.linalg.eigh(cov)
+            L = eigvecs * np.sqrt(np.clip(eigvals, 0.0, None))
+        L = np.ascontiguousarray(L)
+        LT = np.ascontiguousarray(L.T)
+        
+        # Objective function: maximize Sharpe ratio (minimize negative Sharpe),
+        # with its analytical gradient (avoids finite differences)
         def objective(w):
-            portfolio_return = np.dot(w, returns)
-            portfolio_variance = np.dot(w, np.dot(covariance_matrix, w))
-            portfolio_risk = np.sqrt(portfolio_variance)
-            
-            risk_free_rate = 0.02
-            sharpe = (portfolio_return - risk_free_rate) / portfolio_risk if portfolio_risk > 0 else 0
-            
-            return -sharpe  # Minimize negative Sharpe = Maximize Sharpe
+            return _sharpe_neg(w, mu, LT, risk_free_rate)
+        
+        def objective_jac(w):
+            return _sharpe_neg_jac(w, mu, L, LT, risk_free_rate)
         
-        # Constraints
+        # Constraints (the sum-to-1 gradient is constant)
+        sum_jac = np.ones(n)
         constraints_list = [
-            {'type': 'eq', 'fun': lambda w: np.sum(w) - 1.0}  # Weights sum to 1
+            {'type': 'eq', 'fun': lambda w: np.sum(w) - 1.0, 'jac': lambda w: sum_jac}  # Weights sum to 1
         ]
         
         # Bounds for each weight
@@ -211,6 +310,7 @@ def optimize_with_modern_portfolio_theory(n, returns, covariance_matrix, risk_fa
             objective,
             initial_weights,
             method='SLSQP',
+            jac=objective_jac,
             bounds=bounds,
             constraints=constraints_list,
             options={'maxiter': 1000}
@@ -234,32 +334,48 @@ def optimize_with_modern_portfolio_theory(n, returns, covariance_matrix, risk_fa
         return np.ones(n) / n
 
 
+def _split_stocks(stocks):
+    """
+    Split the list of stock dicts into parallel (symbols, risk_levels, names) lists
+    Missing/None riskLevel defaults to 5.0
+    """
+    symbols = [stock['symbol'] for stock in stocks]
+    risk_levels = [5.0 if stock.get('riskLevel') is None else stock['riskLevel'] for stock in stocks]
+    names = [stock['name'] for stock in stocks]
+    return symbols, risk_levels, names
+
+
 def calculate_allocations(stocks, weights):
     """
     Calculate portfolio allocations based on optimization weights
     """
-    # Calculate allocations
-    allocations = {}
-    for i, stock in enumerate(stocks):
-        symbol = stock['symbol']
-        allocation_pct = float(weights[i] * 100)
-        allocations[symbol] = round(allocation_pct, 2)
-    
-    return allocations
+    symbols, _, _ = _split_stocks(stocks)
+    return {symbol: round(float(w * 100), 2) for symbol, w in zip(symbols, weights)}
 
 
 def calculate_portfolio_metrics(returns, covariance_matrix, weights):
     """Calculate portfolio performance metrics"""
-    # Expected return
-    portfolio_return = float(np.dot(weights, returns))
-    
-    # Portfolio risk (standard deviation)
-    portfolio_variance = np.dot(weights, np.dot(covariance_matrix, weights))
-    portfolio_risk = float(np.sqrt(portfolio_variance))
+    if len(weights) == 1:
+        # Single stock: w = [1], so return and variance are just its own
+        portfolio_return = float(returns[0])
+        portfolio_risk = float(np.sqrt(covariance_matrix[0, 0]))
+    else:
+        # Expected return
+        portfolio_return = float(np.dot(weights, returns))
+        
+        # Portfolio risk (standard deviation)
+        portfolio_variance = np.einsum('i,ij,j->', weights, covariance_matrix, weights, optimize=True)
+        portfolio_risk = float(np.sqrt(portfolio_variance))
     
+    return _format_metrics(portfolio_return, portfolio_risk)
+
+
+def _format_metrics(portfolio_return, portfolio_risk):
+    """Round return/risk (as %) and add the Sharpe ratio, in the metrics dict format"""
     # Sharpe ratio (assuming risk-free rate = 0.02)
     risk_free_rate = 0.02
-    sharpe_ratio = (portfolio_return - risk_free_rate) / portfolio_risk if portfolio_risk > 0 else 0
+    # Zero-risk portfolios (e.g. riskLevel 0) report a Sharpe ratio of 0
+    sharpe_ratio = (portfolio_return - risk_free_rate) / portfolio_risk if portfolio_risk > RISK_EPSILON else 0.0
     
     return {
         'expectedReturn': round(portfolio_return * 100, 2),
@@ -274,41 +390,45 @@ def generate_efficient_frontier(returns, covariance_matrix, num_portfolios=100):
     Returns list of portfolios on the efficient frontier
     """
     n_assets = len(returns)
-    results = []
     
-    # Generate random portfolios
-    np.random.seed(42)  # For reproducibility
+    # Generate all random portfolios at once (one row per portfolio)
+    rng = np.random.default_rng(42)  # For reproducibility
+    W = rng.random((num_portfolios, n_assets))
+    W /= W.sum(axis=1, keepdims=True)
     
-    for _ in range(num_portfolios):
-        # Random weights
-        weights = np.random.random(n_assets)
-        weights = weights / np.sum(weights)
-        
-        # Calculate metrics
-        portfolio_return = np.dot(weights, returns)
-        portfolio_variance = np.dot(weights, np.dot(covariance_matrix, weights))
-        portfolio_risk = np.sqrt(portfolio_variance)
-        
-        risk_free_rate = 0.02
-        sharpe_ratio = (portfolio_return - risk_free_rate) / portfolio_risk if portfolio_risk > 0 else 0
-        
-        results.append({
-            'risk': round(portfolio_risk * 100, 2),
-            'return': round(portfolio_return * 100, 2),
-            'sharpe': round(sharpe_ratio, 3)
-        })
+    # Calculate metrics for every portfolio in batched BLAS calls
+    cov = np.ascontiguousarray(covariance_matrix)
+    portfolio_returns = W @ returns
+    portfolio_variances = np.einsum('pi,ij,pj->p', W, cov, W, optimize=True)
+    portfolio_risks = np.sqrt(portfolio_variances)
     
-    # Sort by risk
-    results.sort(key=lambda x: x['risk'])
+    risk_free_rate = 0.02
+    # Floor the risk to avoid dividing by zero, then report 0 for zero-risk portfolios
+    sharpe_ratios = (portfolio_returns - risk_free_rate) / np.maximum(portfolio_risks, RISK_EPSILON)
+    sharpe_ratios[portfolio_risks <= RISK_EPSILON] = 0.0
     
-    # Filter to get efficient frontier (remove dominated portfolios)
-    efficient_frontier = []
-    max_return = -float('inf')
+    # Efficient frontier: sort by risk and keep each portfolio whose return beats
+    # every lower-risk portfolio (running max), removing dominated portfolios.
+    # Decided on the reported (rounded) values so no point looks dominated in the output
+    risks_pct = np.round(portfolio_risks * 100, 2)
+    returns_pct = np.round(portfolio_returns * 100, 2)
+    order = np.argsort(risks_pct, kind='stable')
+    sorted_risks = risks_pct[order]
+    sorted_returns = returns_pct[order]
+    sorted_sharpes = sharpe_ratios[order]
+    prev_max = np.concatenate(([-np.inf], np.maximum.accumulate(sorted_returns)[:-1]))
+    on_frontier = sorted_returns > prev_max
     
-    for portfolio in results:
-        if portfolio['return'] > max_return:
-            max_return = portfolio['return']
-            efficient_frontier.append(portfolio)
+    efficient_frontier = [
+        {
+            'risk': float(risk),
+            'return': float(ret),
+            'sharpe': round(float(sharpe), 3)
+        }
+        for risk, ret, sharpe in zip(
+            sorted_risks[on_frontier], sorted_returns[on_frontier], sorted_sharpes[on_frontier]
+        )
+    ]
     
     return efficient_frontier
 
@@ -323,56 +443,69 @@ def backtest_optimization(stocks, periods=['3mo', '6mo', '1y']):
     3. Fetch actual returns from then to now
     4. Compare predicted vs actual performance
     """
+    if not MARKET_DATA_AVAILABLE:
+        print("Warning: yfinance or dateutil not available for backtesting", file=sys.stderr)
+        return []
+    
     try:
-        import yfinance as yf
-        import pandas as pd
-        from dateutil.relativedelta import relativedelta
-        
         symbols = [stock['symbol'] for stock in stocks]
         backtest_results = []
         
         print(f"Starting backtest for {len(symbols)} stocks...", file=sys.stderr)
+        n_stocks = len(symbols)
+        risk_factor = 5.0  # Default risk level
         
+        # Parse periods up front (e.g., '3mo' -> 3 months) so one download covers all of them
+        now = datetime.now()
+        lookbacks = []
         for period in periods:
+            if period.endswith('mo'):
+                lookbacks.append((period, now - relativedelta(months=int(period[:-2]))))
+            elif period.endswith('y'):
+                lookbacks.append((period, now - relativedelta(years=int(period[:-1]))))
+        if not lookbacks:
+            return backtest_results
+        
+        # Single download spanning the earliest training start through today;
+        # each period's training/actual ranges are sliced from it below
+        earliest = min(lookback_date for _, lookback_date in lookbacks) - relativedelta(years=1)
+        full_data = yf.download(
+            symbols,
+            start=earliest.strftime('%Y-%m-%d'),
+            end=now.strftime('%Y-%m-%d'),
+            progress=False,
+            threads=True
+        )
+        
+        full_index = full_data.index
+        if getattr(full_index, 'tz', None) is not None:
+            full_index = full_index.tz_localize(None)
+        
+        # Close prices extracted once; each period is a positional row slice (a view)
+        close_prices = full_data['Close'].to_numpy(dtype=np.float64, copy=False)
+        
+        def slice_dates(start, end):
+            # Same half-open [start, end) day range yf.download(start=, end=) returns,
+            # located by binary search on the sorted date index
+            lo, hi = full_index.searchsorted(
+                [pd.Timestamp(start.strftime('%Y-%m-%d')), pd.Timestamp(end.strftime('%Y-%m-%d'))]
+            )
+            return close_prices[lo:hi]
+        
+        for period, lookback_date in lookbacks:
             try:
-                # Parse period (e.g., '3mo' -> 3 months)
-                if period.endswith('mo'):
-                    months = int(period[:-2])
-                    lookback_date = datetime.now() - relativedelta(months=months)
-                elif period.endswith('y'):
-                    years = int(period[:-1])
-                    lookback_date = datetime.now() - relativedelta(years=years)
-                else:
-                    continue
-                
-                # 1. Fetch historical data UP TO lookback_date (for optimization)
+                # 1. Slice historical data UP TO lookback_date (for optimization)
                 training_start = lookback_date - relativedelta(years=1)
-                data_training = yf.download(
-                    symbols, 
-                    start=training_start.strftime('%Y-%m-%d'),
-                    end=lookback_date.strftime('%Y-%m-%d'),
-                    progress=False
-                )
+                prices_train = slice_dates(training_start, lookback_date)
                 
-                if data_training.empty:
+                if len(prices_train) == 0:
                     print(f"Warning: No training data for period {period}", file=sys.stderr)
                     continue
                 
                 # Calculate returns and covariance from training data
-                if len(symbols) == 1:
-                    prices_train = data_training['Close']
-                    returns_train = prices_train.pct_change().dropna()
-                    mean_returns_train = np.array([returns_train.mean() * 252])
-                    cov_matrix_train = np.array([[returns_train.std() ** 2 * 252]])
-                else:
-                    prices_train = data_training['Close']
-                    returns_train = prices_train.pct_change().dropna()
-                    mean_returns_train = returns_train.mean().values * 252
-                    cov_matrix_train = returns_train.cov().values * 252
+                mean_returns_train, cov_matrix_train = calculate_annualized_stats(prices_train)
                 
                 # 2. Optimize portfolio based on training data
-                n_stocks = len(symbols)
-                risk_factor = 5.0  # Default risk level
                 optimal_weights = optimize_with_modern_portfolio_theory(
                     n_stocks, mean_returns_train, cov_matrix_train, risk_factor
                 )
@@ -380,39 +513,25 @@ def backtest_optimization(stocks, periods=['3mo', '6mo', '1y']):
                     mean_returns_train, cov_matrix_train, optimal_weights
                 )
                 
-                # 3. Fetch actual data FROM lookback_date TO now
-                data_actual = yf.download(
-                    symbols,
-                    start=lookback_date.strftime('%Y-%m-%d'),
-                    end=datetime.now().strftime('%Y-%m-%d'),
-                    progress=False
-                )
+                # 3. Slice actual data FROM lookback_date TO now
+                prices_actual = slice_dates(lookback_date, now)
                 
-                if data_actual.empty:
+                if len(prices_actual) == 0:
                     print(f"Warning: No actual data for period {period}", file=sys.stderr)
                     continue
                 
                 # Calculate actual returns
-                if len(symbols) == 1:
-                    prices_actual = data_actual['Close']
-                    returns_actual = prices_actual.pct_change().dropna()
-                    mean_returns_actual = np.array([returns_actual.mean() * 252])
-                    cov_matrix_actual = np.array([[returns_actual.std() ** 2 * 252]])
-                else:
-                    prices_actual = data_actual['Close']
-                    returns_actual = prices_actual.pct_change().dropna()
-                    mean_returns_actual = returns_actual.mean().values * 252
-                    cov_matrix_actual = returns_actual.cov().values * 252
+                mean_returns_actual, cov_matrix_actual = calculate_annualized_stats(prices_actual)
                 
                 # 4. Calculate actual metrics with optimized weights
                 actual_metrics = calculate_portfolio_metrics(
                     mean_returns_actual, cov_matrix_actual, optimal_weights
                 )
                 
-                # Also calculate equal-weight baseline
-                equal_weights = np.ones(len(symbols)) / len(symbols)
-                baseline_metrics = calculate_portfolio_metrics(
-                    mean_returns_actual, cov_matrix_actual, equal_weights
+                # Also calculate equal-weight baseline: with w = 1/n, w^T mu is mean(mu)
+                # and w^T Sigma w is mean(Sigma), so no quadratic form is needed
+                baseline_metrics = _format_metrics(
+                    float(mean_returns_actual.mean()), float(np.sqrt(cov_matrix_actual.mean()))
                 )
                 
                 backtest_results.append({
@@ -444,14 +563,46 @@ def backtest_optimization(stocks, periods=['3mo', '6mo', '1y']):
         
         return backtest_results
         
-    except ImportError:
-        print("Warning: yfinance or dateutil not available for backtesting", file=sys.stderr)
-        return []
     except Exception as e:
         print(f"Error in backtesting: {e}", file=sys.stderr)
         return []
 
 
+# Static Markdown blocks shared by the reason generators
+_METRICS_TABLE_HEADER = (
+    "### 📊 최적화된 포트폴리오 특성\n\n"
+    "| 지표 | 값 | 평가 |\n"
+    "|------|------|------|\n"
+)
+
+_HOLD_REASONS = (
+    "**유지 이유:**\n"
+    "• 현재 비중이 리스크-수익 균형에 최적화되어 있습니다\n"
+    "• 추가 조정 시 거래비용만 발생하고 개선 효과가 미미합니다\n"
+    "• 포트폴리오 전체 안정성에 적절히 기여하고 있습니다"
+)
+
+_INCREASE_OPTIMIZATION_EFFECT = (
+    "3. **포트폴리오 최적화 효과** 💡\n"
+    "   - 다른 종목과의 **분산 효과**로 전체 리스크 감소\n"
+    "   - 샤프 지수(위험 대비 수익) 개선\n"
+    "   - 목표 위험 수준 내에서 수익 극대화\n\n"
+)
+
+_DECREASE_EFFICIENCY = (
+    "2. **효율성 개선** 🎯\n"
+    "   - 현재 비중이 최적 수준보다 높음\n"
+    "   - 비중 조정으로 다른 종목 투자 기회 확보\n\n"
+)
+
+_DECREASE_REBALANCING = (
+    "3. **포트폴리오 리밸런싱** ⚖️\n"
+    "   - 다른 고수익 종목으로 자금 재배치\n"
+    "   - 전체 포트폴리오 샤프 지수 개선\n"
+    "   - 더 효율적인 리스크-수익 구조 구축\n\n"
+)
+
+
 def generate_optimization_reason(stocks, weights, returns, covariance_matrix, metrics, target_risk):
     """Generate detailed optimization strategy explanation with reasoning"""
     n_stocks = len(stocks)
@@ -461,132 +612,132 @@ def generate_optimization_reason(stocks, weights, returns, covariance_matrix, me
     
     # Calculate correlations between stocks
     if n_stocks > 1:
-        # Calculate correlation from covariance matrix
-        std_devs = np.sqrt(np.diag(covariance_matrix))
-        correlation_matrix = covariance_matrix / np.outer(std_devs, std_devs)
-        # Get average correlation (excluding diagonal)
-        avg_correlation = np.mean(np.abs(correlation_matrix[np.triu_indices_from(correlation_matrix, k=1)]))
+        # Calculate correlation from covariance matrix (scale rows/columns in place,
+        # no n x n outer-product temporary)
+        inv_std = 1.0 / np.sqrt(np.diag(covariance_matrix))
+        correlation_matrix = covariance_matrix * inv_std
+        correlation_matrix *= inv_std[:, None]
+        # Get average correlation (excluding diagonal); the matrix is symmetric, so the
+        # off-diagonal mean equals the strict upper-triangle mean
+        abs_correlation = np.abs(correlation_matrix)
+        avg_correlation = (abs_correlation.sum() - np.trace(abs_correlation)) / (n_stocks * (n_stocks - 1))
     else:
         correlation_matrix = np.array([[1.0]])
         avg_correlation = 0.0
     
     # Find top allocated stocks with details
-    stock_details = []
-    for i in range(n_stocks):
-        stock_details.append({
-            'name': stocks[i]['name'],
-            'symbol': stocks[i]['symbol'],
-            'weight': weights[i] * 100,
-            'return': returns[i] * 100,
-            'risk': stocks[i]['riskLevel'],
-            'variance': covariance_matrix[i, i] * 100
-        })
+    symbols, risk_levels, names = _split_stocks(stocks)
+    stock_details = [
+        {'name': name, 'symbol': symbol, 'weight': w, 'return': r, 'risk': risk, 'variance': var}
+        for name, symbol, w, r, risk, var in zip(
+            names, symbols, np.asarray(weights) * 100, np.asarray(returns) * 100,
+            risk_levels, np.diag(covariance_matrix) * 100
+        )
+    ]
     stock_details.sort(key=lambda x: x['weight'], reverse=True)
     
     # Generate comprehensive reason
-    reason = f"## 🎯 최적화 분석 결과\n\n"
-    reason += f"위험 수준 {target_risk}/10에 맞춰 **위험 대비 최대 수익**을 추구하는 포트폴리오를 구성했습니다.\n\n"
+    parts = [f"## 🎯 최적화 분석 결과\n\n"]
+    parts.append(f"위험 수준 {target_risk}/10에 맞춰 **위험 대비 최대 수익**을 추구하는 포트폴리오를 구성했습니다.\n\n")
     
     # Portfolio characteristics
-    reason += f"### 📊 최적화된 포트폴리오 특성\n\n"
-    reason += f"| 지표 | 값 | 평가 |\n"
-    reason += f"|------|------|------|\n"
-    reason += f"| **예상 연간 수익률** | {portfolio_return:.2f}% | "
+    parts.append(_METRICS_TABLE_HEADER)
+    parts.append(f"| **예상 연간 수익률** | {portfolio_return:.2f}% | ")
     if portfolio_return > 20:
-        reason += "매우 높음 🚀 |\n"
+        parts.append("매우 높음 🚀 |\n")
     elif portfolio_return > 10:
-        reason += "높음 📈 |\n"
+        parts.append("높음 📈 |\n")
     elif portfolio_return > 5:
-        reason += "적정 ✅ |\n"
+        parts.append("적정 ✅ |\n")
     else:
-        reason += "보수적 🛡️ |\n"
+        parts.append("보수적 🛡️ |\n")
     
-    reason += f"| **포트폴리오 변동성** | {portfolio_risk:.2f}% | "
+    parts.append(f"| **포트폴리오 변동성** | {portfolio_risk:.2f}% | ")
     if portfolio_risk < 15:
-        reason += "낮음 (안정적) |\n"
+        parts.append("낮음 (안정적) |\n")
     elif portfolio_risk < 25:
-        reason += "적정 |\n"
+        parts.append("적정 |\n")
     else:
-        reason += "높음 (주의) |\n"
+        parts.append("높음 (주의) |\n")
     
-    reason += f"| **샤프 지수** | {sharpe_ratio:.3f} | "
+    parts.append(f"| **샤프 지수** | {sharpe_ratio:.3f} | ")
     if sharpe_ratio > 2.0:
-        reason += "매우 우수 ⭐⭐⭐ |\n"
+        parts.append("매우 우수 ⭐⭐⭐ |\n")
     elif sharpe_ratio > 1.0:
-        reason += "우수 ⭐⭐ |\n"
+        parts.append("우수 ⭐⭐ |\n")
     elif sharpe_ratio > 0.5:
-        reason += "양호 ⭐ |\n"
+        parts.append("양호 ⭐ |\n")
     else:
-        reason += "개선 필요 |\n"
+        parts.append("개선 필요 |\n")
     
-    reason += f"| **종목 간 평균 상관계수** | {avg_correlation:.3f} | "
+    parts.append(f"| **종목 간 평균 상관계수** | {avg_correlation:.3f} | ")
     if avg_correlation < 0.3:
-        reason += "분산 효과 높음 ✅ |\n"
+        parts.append("분산 효과 높음 ✅ |\n")
     elif avg_correlation < 0.6:
-        reason += "적정한 분산 |\n"
+        parts.append("적정한 분산 |\n")
     else:
-        reason += "분산 효과 낮음 ⚠️ |\n"
+        parts.append("분산 효과 낮음 ⚠️ |\n")
     
-    reason += f"\n"
+    parts.append(f"\n")
     
     # 3. Why these weights?
-    reason += f"### 🎯 종목별 배분 근거\n\n"
+    parts.append(f"### 🎯 종목별 배분 근거\n\n")
     for idx, stock in enumerate(stock_details[:5], 1):  # Top 5 stocks
-        reason += f"**{idx}. {stock['name']} ({stock['symbol']})** - {stock['weight']:.1f}%\n"
-        reason += f"```\n"
-        reason += f"• 예상 수익률: {stock['return']:.2f}% (연간)\n"
-        reason += f"• 위험도: {stock['risk']}/10\n"
-        reason += f"• 변동성: {np.sqrt(stock['variance']):.2f}%\n"
+        parts.append(f"**{idx}. {stock['name']} ({stock['symbol']})** - {stock['weight']:.1f}%\n")
+        parts.append(f"```\n")
+        parts.append(f"• 예상 수익률: {stock['return']:.2f}% (연간)\n")
+        parts.append(f"• 위험도: {stock['risk']}/10\n")
+        parts.append(f"• 변동성: {np.sqrt(stock['variance']):.2f}%\n")
         
         # Reasoning for this weight
         if stock['weight'] > 30:
-            reason += f"• 비중 이유: 높은 수익률({stock['return']:.1f}%)과 적절한 리스크로 핵심 보유 종목\n"
+            parts.append(f"• 비중 이유: 높은 수익률({stock['return']:.1f}%)과 적절한 리스크로 핵심 보유 종목\n")
         elif stock['weight'] > 20:
-            reason += f"• 비중 이유: 우수한 수익률과 포트폴리오 안정성 기여\n"
+            parts.append(f"• 비중 이유: 우수한 수익률과 포트폴리오 안정성 기여\n")
         elif stock['weight'] > 10:
-            reason += f"• 비중 이유: 분산투자 효과로 전체 리스크 감소\n"
+            parts.append(f"• 비중 이유: 분산투자 효과로 전체 리스크 감소\n")
         else:
-            reason += f"• 비중 이유: 소량 보유로 추가 분산 효과 제공\n"
+            parts.append(f"• 비중 이유: 소량 보유로 추가 분산 효과 제공\n")
         
-        reason += f"```\n\n"
+        parts.append(f"```\n\n")
     
     # 4. Strategy explanation
-    reason += f"### 💭 최적화 전략 설명\n\n"
+    parts.append(f"### 💭 최적화 전략 설명\n\n")
     
     if sharpe_ratio > 1.5:
-        reason += f"**✅ 위험 대비 수익이 매우 우수한 포트폴리오**\n\n"
-        reason += f"샤프 지수 {sharpe_ratio:.3f}는 투자한 위험 1단위당 {sharpe_ratio:.2f}배의 초과수익을 얻을 수 있음을 의미합니다. "
-        reason += f"이는 시장 평균(샤프 지수 1.0)을 크게 상회하는 수준으로, **현재 포트폴리오 구성이 매우 효율적**입니다.\n\n"
+        parts.append(f"**✅ 위험 대비 수익이 매우 우수한 포트폴리오**\n\n")
+        parts.append(f"샤프 지수 {sharpe_ratio:.3f}는 투자한 위험 1단위당 {sharpe_ratio:.2f}배의 초과수익을 얻을 수 있음을 의미합니다. ")
+        parts.append(f"이는 시장 평균(샤프 지수 1.0)을 크게 상회하는 수준으로, **현재 포트폴리오 구성이 매우 효율적**입니다.\n\n")
     elif sharpe_ratio > 1.0:
-        reason += f"**✅ 균형 잡힌 리스크-수익 구조**\n\n"
-        reason += f"샤프 지수 {sharpe_ratio:.3f}는 적절한 위험 관리 하에서 양호한 수익을 추구하는 포트폴리오입니다. "
-        reason += f"시장 평균 수준의 효율성을 보이고 있습니다.\n\n"
+        parts.append(f"**✅ 균형 잡힌 리스크-수익 구조**\n\n")
+        parts.append(f"샤프 지수 {sharpe_ratio:.3f}는 적절한 위험 관리 하에서 양호한 수익을 추구하는 포트폴리오입니다. ")
+        parts.append(f"시장 평균 수준의 효율성을 보이고 있습니다.\n\n")
     else:
-        reason += f"**⚠️ 보수적인 포트폴리오**\n\n"
-        reason += f"샤프 지수 {sharpe_ratio:.3f}는 안정성을 중시하는 구성입니다. "
-        reason += f"더 높은 수익을 원하신다면 고수익 종목 비중을 늘려보세요.\n\n"
+        parts.append(f"**⚠️ 보수적인 포트폴리오**\n\n")
+        parts.append(f"샤프 지수 {sharpe_ratio:.3f}는 안정성을 중시하는 구성입니다. ")
+        parts.append(f"더 높은 수익을 원하신다면 고수익 종목 비중을 늘려보세요.\n\n")
     
     # Risk level assessment
     if portfolio_risk < target_risk * 0.8:
-        reason += f"**📌 위험 수준 평가:** 목표({target_risk})보다 낮은 변동성({portfolio_risk:.1f}%)으로 **매우 안정적**이지만, "
-        reason += f"더 공격적인 투자를 원하신다면 고수익 종목 비중을 늘릴 수 있습니다.\n\n"
+        parts.append(f"**📌 위험 수준 평가:** 목표({target_risk})보다 낮은 변동성({portfolio_risk:.1f}%)으로 **매우 안정적**이지만, ")
+        parts.append(f"더 공격적인 투자를 원하신다면 고수익 종목 비중을 늘릴 수 있습니다.\n\n")
     elif portfolio_risk > target_risk * 1.3:
-        reason += f"**⚠️ 위험 수준 평가:** 목표({target_risk})보다 높은 변동성({portfolio_risk:.1f}%)으로 **변동성 주의**가 필요합니다. "
-        reason += f"단기 손실 가능성을 염두에 두시고, 필요시 안정적인 종목 비중을 늘리세요.\n\n"
+        parts.append(f"**⚠️ 위험 수준 평가:** 목표({target_risk})보다 높은 변동성({portfolio_risk:.1f}%)으로 **변동성 주의**가 필요합니다. ")
+        parts.append(f"단기 손실 가능성을 염두에 두시고, 필요시 안정적인 종목 비중을 늘리세요.\n\n")
     else:
-        reason += f"**✅ 위험 수준 평가:** 목표 위험 수준({target_risk})에 부합하는 변동성({portfolio_risk:.1f}%)으로 **적정한 포트폴리오**입니다.\n\n"
+        parts.append(f"**✅ 위험 수준 평가:** 목표 위험 수준({target_risk})에 부합하는 변동성({portfolio_risk:.1f}%)으로 **적정한 포트폴리오**입니다.\n\n")
     
     # Diversification effect
     if avg_correlation < 0.4:
-        reason += f"**🎯 분산투자 효과:** 종목 간 상관계수가 {avg_correlation:.3f}로 낮아 **탁월한 분산투자 효과**를 보입니다. "
-        reason += f"각 종목이 서로 다른 시장 상황에서 보완적으로 작동하여 전체 포트폴리오의 안정성을 높입니다.\n\n"
+        parts.append(f"**🎯 분산투자 효과:** 종목 간 상관계수가 {avg_correlation:.3f}로 낮아 **탁월한 분산투자 효과**를 보입니다. ")
+        parts.append(f"각 종목이 서로 다른 시장 상황에서 보완적으로 작동하여 전체 포트폴리오의 안정성을 높입니다.\n\n")
     elif avg_correlation < 0.7:
-        reason += f"**🎯 분산투자 효과:** 종목 간 상관계수가 {avg_correlation:.3f}로 **적절한 분산효과**를 보입니다.\n\n"
+        parts.append(f"**🎯 분산투자 효과:** 종목 간 상관계수가 {avg_correlation:.3f}로 **적절한 분산효과**를 보입니다.\n\n")
     else:
-        reason += f"**⚠️ 분산투자 효과:** 종목 간 상관계수가 {avg_correlation:.3f}로 높아 **분산효과가 제한적**입니다. "
-        reason += f"서로 다른 산업군의 종목을 추가하면 리스크를 더 낮출 수 있습니다.\n\n"
+        parts.append(f"**⚠️ 분산투자 효과:** 종목 간 상관계수가 {avg_correlation:.3f}로 높아 **분산효과가 제한적**입니다. ")
+        parts.append(f"서로 다른 산업군의 종목을 추가하면 리스크를 더 낮출 수 있습니다.\n\n")
     
-    return reason
+    return "".join(parts)
 
 
 def generate_recommendation_reasons(stocks, weights, current_weights, returns):
@@ -596,196 +747,364 @@ def generate_recommendation_reasons(stocks, weights, current_weights, returns):
     # Calculate average return for comparison
     avg_return = np.mean(returns) * 100
     
-    for i, stock in enumerate(stocks):
-        symbol = stock['symbol']
-        name = stock['name']
-        optimal_weight = weights[i] * 100
-        current_weight = current_weights[i] * 100
-        expected_return = returns[i] * 100
-        risk_level = stock.get('riskLevel', 5.0)  # Default to 5.0 if None
-        if risk_level is None:
-            risk_level = 5.0
-        
+    symbols, risk_levels, names = _split_stocks(stocks)
+    for symbol, name, optimal_weight, current_weight, expected_return, risk_level in zip(
+        symbols, names, np.asarray(weights) * 100, np.asarray(current_weights) * 100,
+        np.asarray(returns) * 100, risk_levels
+    ):
         diff = optimal_weight - current_weight
         
         if abs(diff) < 2:
             # 유지 추천
-            reason = f"**✅ {name} 보유 비중 유지**\n\n"
-            reason += f"현재 비중 **{current_weight:.1f}%**가 최적 수준에 근접합니다.\n\n"
-            reason += f"**현재 상태:**\n"
-            reason += f"• 예상 연간 수익률: {expected_return:.1f}%\n"
-            reason += f"• 위험도: {risk_level}/10\n"
-            reason += f"• 포트폴리오 기여도: 적정\n\n"
-            reason += f"**유지 이유:**\n"
-            reason += f"• 현재 비중이 리스크-수익 균형에 최적화되어 있습니다\n"
-            reason += f"• 추가 조정 시 거래비용만 발생하고 개선 효과가 미미합니다\n"
-            reason += f"• 포트폴리오 전체 안정성에 적절히 기여하고 있습니다"
-            reasons[symbol] = reason
+            parts = [f"**✅ {name} 보유 비중 유지**\n\n"]
+            parts.append(f"현재 비중 **{current_weight:.1f}%**가 최적 수준에 근접합니다.\n\n")
+            parts.append(f"**현재 상태:**\n")
+            parts.append(f"• 예상 연간 수익률: {expected_return:.1f}%\n")
+            parts.append(f"• 위험도: {risk_level}/10\n")
+            parts.append(f"• 포트폴리오 기여도: 적정\n\n")
+            parts.append(_HOLD_REASONS)
+            reasons[symbol] = "".join(parts)
             
         elif diff > 0:
             # 매수 추천
-            reason = f"**📈 {name} 비중 증가 ({current_weight:.1f}% → {optimal_weight:.1f}%)**\n\n"
-            reason += f"**{abs(diff):.1f}%p 증가**를 추천합니다 (약 ₩{abs(diff) * 100000:,.0f} 추가 투자)\n\n"
+            parts = [f"**📈 {name} 비중 증가 ({current_weight:.1f}% → {optimal_weight:.1f}%)**\n\n"]
+            parts.append(f"**{abs(diff):.1f}%p 증가**를 추천합니다 (약 ₩{abs(diff) * 100000:,.0f} 추가 투자)\n\n")
             
-            reason += f"**증가 추천 이유:**\n\n"
+            parts.append(f"**증가 추천 이유:**\n\n")
             
             # Reason 1: Return analysis
             if expected_return > avg_return * 1.2:
-                reason += f"1. **높은 수익 잠재력** 🎯\n"
-                reason += f"   - 예상 연간 수익률: **{expected_return:.1f}%**\n"
-                reason += f"   - 포트폴리오 평균({avg_return:.1f}%)보다 **{expected_return - avg_return:.1f}%p 높음**\n"
-                reason += f"   - 고수익 종목으로 전체 포트폴리오 수익률 향상에 기여\n\n"
+                parts.append(f"1. **높은 수익 잠재력** 🎯\n")
+                parts.append(f"   - 예상 연간 수익률: **{expected_return:.1f}%**\n")
+                parts.append(f"   - 포트폴리오 평균({avg_return:.1f}%)보다 **{expected_return - avg_return:.1f}%p 높음**\n")
+                parts.append(f"   - 고수익 종목으로 전체 포트폴리오 수익률 향상에 기여\n\n")
             elif expected_return > avg_return:
-                reason += f"1. **안정적인 수익 기대** 📊\n"
-                reason += f"   - 예상 연간 수익률: **{expected_return:.1f}%**\n"
-                reason += f"   - 포트폴리오 평균 이상의 성과 기대\n\n"
+                parts.append(f"1. **안정적인 수익 기대** 📊\n")
+                parts.append(f"   - 예상 연간 수익률: **{expected_return:.1f}%**\n")
+                parts.append(f"   - 포트폴리오 평균 이상의 성과 기대\n\n")
             
             # Reason 2: Risk analysis
             if risk_level < 5:
-                reason += f"2. **낮은 위험도로 안정적** 🛡️\n"
-                reason += f"   - 위험도: **{risk_level}/10** (낮음)\n"
-                reason += f"   - 변동성이 낮아 포트폴리오 전체 리스크 감소\n"
-                reason += f"   - 시장 하락 시에도 손실 제한 효과\n\n"
+                parts.append(f"2. **낮은 위험도로 안정적** 🛡️\n")
+                parts.append(f"   - 위험도: **{risk_level}/10** (낮음)\n")
+                parts.append(f"   - 변동성이 낮아 포트폴리오 전체 리스크 감소\n")
+                parts.append(f"   - 시장 하락 시에도 손실 제한 효과\n\n")
             elif risk_level <= 7:
-                reason += f"2. **적정한 위험 수준** ⚖️\n"
-                reason += f"   - 위험도: **{risk_level}/10** (중간)\n"
-                reason += f"   - 수익-리스크 균형이 좋은 종목\n\n"
+                parts.append(f"2. **적정한 위험 수준** ⚖️\n")
+                parts.append(f"   - 위험도: **{risk_level}/10** (중간)\n")
+                parts.append(f"   - 수익-리스크 균형이 좋은 종목\n\n")
             else:
-                reason += f"2. **고위험-고수익 전략** 🚀\n"
-                reason += f"   - 위험도: **{risk_level}/10** (높음)\n"
-                reason += f"   - 높은 변동성이지만 대규모 수익 기회\n"
-                reason += f"   - 분산투자로 리스크 관리 필요\n\n"
+                parts.append(f"2. **고위험-고수익 전략** 🚀\n")
+                parts.append(f"   - 위험도: **{risk_level}/10** (높음)\n")
+                parts.append(f"   - 높은 변동성이지만 대규모 수익 기회\n")
+                parts.append(f"   - 분산투자로 리스크 관리 필요\n\n")
             
             # Reason 3: Portfolio optimization
-            reason += f"3. **포트폴리오 최적화 효과** 💡\n"
-            reason += f"   - 다른 종목과의 **분산 효과**로 전체 리스크 감소\n"
-            reason += f"   - 샤프 지수(위험 대비 수익) 개선\n"
-            reason += f"   - 목표 위험 수준 내에서 수익 극대화\n\n"
+            parts.append(_INCREASE_OPTIMIZATION_EFFECT)
             
-            reason += f"**투자 전략:** 비중을 늘려 포트폴리오 효율성을 높이세요."
-            reasons[symbol] = reason
+            parts.append(f"**투자 전략:** 비중을 늘려 포트폴리오 효율성을 높이세요.")
+            reasons[symbol] = "".join(parts)
             
         else:
             # 매도 추천
-            reason = f"**📉 {name} 비중 감소 ({current_weight:.1f}% → {optimal_weight:.1f}%)**\n\n"
-            reason += f"**{abs(diff):.1f}%p 감소**를 추천합니다 (약 ₩{abs(diff) * 100000:,.0f} 매도)\n\n"
+            parts = [f"**📉 {name} 비중 감소 ({current_weight:.1f}% → {optimal_weight:.1f}%)**\n\n"]
+            parts.append(f"**{abs(diff):.1f}%p 감소**를 추천합니다 (약 ₩{abs(diff) * 100000:,.0f} 매도)\n\n")
             
-            reason += f"**감소 추천 이유:**\n\n"
+            parts.append(f"**감소 추천 이유:**\n\n")
             
             # Reason 1: Return analysis
             if expected_return < avg_return * 0.8:
-                reason += f"1. **상대적으로 낮은 수익률** 📊\n"
-                reason += f"   - 예상 연간 수익률: **{expected_return:.1f}%**\n"
-                reason += f"   - 포트폴리오 평균({avg_return:.1f}%)보다 **{abs(expected_return - avg_return):.1f}%p 낮음**\n"
-                reason += f"   - 더 높은 수익 종목으로 자금 재배치 필요\n\n"
+                parts.append(f"1. **상대적으로 낮은 수익률** 📊\n")
+                parts.append(f"   - 예상 연간 수익률: **{expected_return:.1f}%**\n")
+                parts.append(f"   - 포트폴리오 평균({avg_return:.1f}%)보다 **{abs(expected_return - avg_return):.1f}%p 낮음**\n")
+                parts.append(f"   - 더 높은 수익 종목으로 자금 재배치 필요\n\n")
             elif expected_return < avg_return:
-                reason += f"1. **수익률 개선 여지** 📈\n"
-                reason += f"   - 예상 수익률: **{expected_return:.1f}%**\n"
-                reason += f"   - 다른 종목 대비 성과가 낮은 편\n\n"
+                parts.append(f"1. **수익률 개선 여지** 📈\n")
+                parts.append(f"   - 예상 수익률: **{expected_return:.1f}%**\n")
+                parts.append(f"   - 다른 종목 대비 성과가 낮은 편\n\n")
             
             # Reason 2: Risk analysis
             if risk_level > 7:
-                reason += f"2. **높은 변동성 리스크** ⚠️\n"
-                reason += f"   - 위험도: **{risk_level}/10** (높음)\n"
-                reason += f"   - 과도한 비중은 포트폴리오 전체 변동성 증가\n"
-                reason += f"   - 시장 하락 시 큰 손실 가능성\n\n"
+                parts.append(f"2. **높은 변동성 리스크** ⚠️\n")
+                parts.append(f"   - 위험도: **{risk_level}/10** (높음)\n")
+                parts.append(f"   - 과도한 비중은 포트폴리오 전체 변동성 증가\n")
+                parts.append(f"   - 시장 하락 시 큰 손실 가능성\n\n")
             else:
-                reason += f"2. **효율성 개선** 🎯\n"
-                reason += f"   - 현재 비중이 최적 수준보다 높음\n"
-                reason += f"   - 비중 조정으로 다른 종목 투자 기회 확보\n\n"
+                parts.append(_DECREASE_EFFICIENCY)
             
             # Reason 3: Concentration risk
             if current_weight > 30:
-                reason += f"3. **집중 리스크 완화** 🛡️\n"
-                reason += f"   - 현재 비중({current_weight:.1f}%)이 지나치게 높음\n"
-                reason += f"   - 특정 종목 의존도가 높아 위험\n"
-                reason += f"   - 분산투자로 안정성 확보 필요\n\n"
+                parts.append(f"3. **집중 리스크 완화** 🛡️\n")
+                parts.append(f"   - 현재 비중({current_weight:.1f}%)이 지나치게 높음\n")
+                parts.append(f"   - 특정 종목 의존도가 높아 위험\n")
+                parts.append(f"   - 분산투자로 안정성 확보 필요\n\n")
             else:
-                reason += f"3. **포트폴리오 리밸런싱** ⚖️\n"
-                reason += f"   - 다른 고수익 종목으로 자금 재배치\n"
-                reason += f"   - 전체 포트폴리오 샤프 지수 개선\n"
-                reason += f"   - 더 효율적인 리스크-수익 구조 구축\n\n"
+                parts.append(_DECREASE_REBALANCING)
             
-            reason += f"**투자 전략:** 비중을 줄여 자금을 더 효율적으로 배분하세요."
-            reasons[symbol] = reason
+            parts.append(f"**투자 전략:** 비중을 줄여 자금을 더 효율적으로 배분하세요.")
+            reasons[symbol] = "".join(parts)
     
     return reasons
 
 
+def _upper_triangular(quadratic):
+    """
+    Fold a square quadratic-form matrix into its upper triangle (x^T Q x unchanged),
+    the canonical form QuadraticProgram stores, so the converter handles half the entries
+    """
+    return np.triu(quadratic + quadratic.T, 1) + np.diag(np.diag(quadratic))
+
+
+@functools.lru_cache(maxsize=None)
+def _bit_values(bits_per_asset):
+    """
+    Place value of each bit of an asset's discretized weight, 2**bit / (2**bits - 1),
+    so the bits of a weight level sum to that level's fraction (read-only, cached)
+    """
+    bv = np.left_shift(1, np.arange(bits_per_asset)).astype(np.float64) / ((1 << bits_per_asset) - 1)
+    bv.setflags(write=False)
+    return bv
+
+
+def _qubo_coefficients(returns, covariance_matrix, risk_factor, bits_per_asset):
+    """
+    Linear vector and upper-triangular quadratic matrix of the portfolio QUBO
+    (minimize), over bits_per_asset binary variables per asset in (asset, bit) order
+    """
+    # Built in float32 (half the bytes; a binary solver's argmin does not need
+    # float64 precision) and upcast once to the float64 qiskit expects
+    # Bit place values of each asset's discretized weight
+    bv = _bit_values(bits_per_asset).astype(np.float32)
+    
+    # Objective: Maximize return - risk_factor * variance
+    # Linear terms (returns), negative for minimization
+    linear = np.kron(-np.asarray(returns, dtype=np.float32), bv)
+    
+    # Quadratic terms (risk penalty): Q[(i, bit_i), (j, bit_j)] = penalty * cov[i, j] * bv[bit_i] * bv[bit_j]
+    risk_penalty = np.float32(risk_factor * 2.0)
+    quadratic = _upper_triangular(
+        risk_penalty * np.kron(np.asarray(covariance_matrix, dtype=np.float32), np.outer(bv, bv))
+    )
+    return linear.astype(np.float64), quadratic.astype(np.float64)
+
+
+@functools.lru_cache(maxsize=32)
+def _build_qubo(num_vars, linear_bytes, quadratic_bytes):
+    """
+    Build the portfolio QUBO shared by QAOA and VQE from its _qubo_coefficients
+    and convert it with QuadraticProgramToQubo, memoized on the coefficients
+    (passed as float64 bytes so they are hashable)
+    
+    Each asset's weight is discretized into bits_per_asset binary variables,
+    in (asset, bit) order: variable i * bits_per_asset + bit. The returned program is shared between
+    calls and must not be modified.
+    """
+    linear = np.frombuffer(linear_bytes, dtype=np.float64)
+    quadratic = np.frombuffer(quadratic_bytes, dtype=np.float64).reshape(num_vars, num_vars)
+    
+    # Create quadratic program for portfolio optimization
+    qp = QuadraticProgram('portfolio')
+    
+    # Add variables in one call; they are addressed by position (x0, x1, ...), not name
+    qp.binary_var_list(num_vars, name='x')
+    
+    # Set objective (coefficients passed as arrays in variable order, not name-keyed dicts)
+    qp.minimize(linear=linear, quadratic=quadratic)
+    
+    # Convert to QUBO
+    converter = QuadraticProgramToQubo()
+    return converter.convert(qp)
+
+
+def _portfolio_qubo(linear, quadratic):
+    """Cached QUBO for the given _qubo_coefficients (see _build_qubo)"""
+    return _build_qubo(
+        len(linear),
+        np.ascontiguousarray(linear, dtype=np.float64).tobytes(),
+        np.ascontiguousarray(quadratic, dtype=np.float64).tobytes()
+    )
+
+
+def _solve_small_qubo(linear, quadratic):
+    """
+    Exact minimizer of linear.x + x^T quadratic x over binary x when that is cheap
+    classically: thresholding when there is no quadratic term (e.g. risk_factor 0),
+    exhaustive search up to CLASSICAL_QUBO_MAX_BITS variables.
+    Returns a boolean array, or None when the problem is too large.
+    """
+    n_bits = len(linear)
+    if not quadratic.any():
+        return linear < 0
+    if n_bits > CLASSICAL_QUBO_MAX_BITS:
+        return None
+    
+    # Enumerate all 2**n_bits bitstrings in blocks to bound memory (float32:
+    # half the memory traffic of the block products)
+    linear = linear.astype(np.float32)
+    quadratic = quadratic.astype(np.float32)
+    shifts = np.arange(n_bits)
+    block_size = 1 << min(n_bits, 16)
+    best_value, best_x = np.inf, None
+    for start in range(0, 1 << n_bits, block_size):
+        X = ((np.arange(start, start + block_size)[:, None] >> shifts) & 1).astype(np.float32)
+        values = X @ linear + ((X @ quadratic) * X).sum(axis=1)
+        k = np.argmin(values)
+        if values[k] < best_value:
+            best_value, best_x = values[k], X[k] > 0.5
+    return best_x
+
+
+def _ising_coefficients(linear, quadratic):
+    """
+    Ising fields h and couplings J (symmetric, zero diagonal) of the QUBO
+    linear.x + x^T quadratic x (quadratic upper triangular) under x = (1 - z) / 2,
+    the mapping QuadraticProgram.to_ising uses; the constant offset is dropped
+    """
+    off_diag = np.triu(quadratic, 1)
+    h = -(linear + np.diag(quadratic)) / 2 - (off_diag.sum(axis=1) + off_diag.sum(axis=0)) / 4
+    J = (off_diag + off_diag.T) / 4
+    return h, J
+
+
+def _qaoa_p1_energy_grid(h, J, betas, gammas):
+    """
+    Exact depth-1 QAOA energy <H> on a (beta x gamma) grid for the Ising cost
+    H = sum h_u Z_u + sum_{u<v} J_uv Z_u Z_v, in closed form (polynomial in the
+    number of qubits, no circuit simulation), following Ozaeta, van Dam and McMahon,
+    "Expectation values from the single-layer QAOA on Ising problems"
+    """
+    n = len(h)
+    idx = np.arange(n)
+    # others[u, v, w]: w is neither u nor v
+    others = (idx[None, None, :] != idx[:, None, None]) & (idx[None, None, :] != idx[None, :, None])
+    iu, iv = np.triu_indices(n, 1)
+    J_pair = J[iu, iv]
+    J_plus = J[:, None, :] + J[None, :, :]
+    J_minus = J[:, None, :] - J[None, :, :]
+    
+    energy = np.empty((len(betas), len(gammas)))
+    for g, gamma in enumerate(gammas):
+        cos_J = np.cos(2 * gamma * J)
+        cos_h = np.cos(2 * gamma * h)
+        # <Z_u> / sin(2 beta)
+        z_single = np.sin(2 * gamma * h) * cos_J.prod(axis=1)
+        # prod_{w != u, v} cos(2 gamma J_uw)
+        prod_u = np.where(others, cos_J[:, None, :], 1.0).prod(axis=2)
+        prod_plus = np.where(others, np.cos(2 * gamma * J_plus), 1.0).prod(axis=2)
+        prod_minus = np.where(others, np.cos(2 * gamma * J_minus), 1.0).prod(axis=2)
+        # <Z_u Z_v> = sin(4 beta)/2 * a_uv - sin^2(2 beta)/2 * b_uv
+        a = np.sin(2 * gamma * J) * (cos_h[:, None] * prod_u + cos_h[None, :] * prod_u.T)
+        b = (np.cos(2 * gamma * (h[:, None] + h[None, :])) * prod_plus
+             - np.cos(2 * gamma * (h[:, None] - h[None, :])) * prod_minus)
+        field_term = h @ z_single
+        a_term = J_pair @ a[iu, iv] / 2
+        b_term = J_pair @ b[iu, iv] / 2
+        energy[:, g] = (np.sin(2 * betas) * field_term + np.sin(4 * betas) * a_term
+                        - np.sin(2 * betas) ** 2 * b_term)
+    return energy
+
+
+def _qaoa_initial_point(qubo, reps, grid_size=16):
+    """
+    QAOA warm start: sweep depth-1 (beta, gamma) on a grid_size x grid_size grid
+    and repeat the best pair for every layer, in the ansatz parameter order
+    (all betas, then all gammas). Returns (initial_point, scale): gamma is in
+    units of the cost operator divided by scale, so both axes share the grid
+    step pi / grid_size. initial_point is None if the cost is identically zero.
+    """
+    linear = qubo.objective.linear.to_array()
+    quadratic = _upper_triangular(qubo.objective.quadratic.to_array())
+    h, J = _ising_coefficients(linear, quadratic)
+    
+    scale = max(np.abs(h).max(), np.abs(J).max())
+    if scale == 0:
+        return None, 1.0
+    betas = np.linspace(0, np.pi, grid_size, endpoint=False)
+    # Phases 2 * gamma * h / scale span about [-pi, pi)
+    gammas = np.linspace(-np.pi / 2, np.pi / 2, grid_size, endpoint=False)
+    
+    energy = _qaoa_p1_energy_grid(h, J, betas, gammas / scale)
+    b, g = np.unravel_index(np.argmin(energy), energy.shape)
+    return np.concatenate((np.full(reps, betas[b]), np.full(reps, gammas[g]))), scale
+
+
+@functools.lru_cache(maxsize=1)
+def _sampler():
+    """Shared sampler primitive, created once per process"""
+    return Sampler()
+
+
+@functools.lru_cache(maxsize=None)
+def _vqe_optimizer(n):
+    """
+    MinimumEigenOptimizer around a flattened TwoLocal SamplingVQE for n qubits;
+    it does not depend on the problem data, so one instance per size is reused
+    """
+    # Sampler-based, as MinimumEigenOptimizer needs the measured bitstrings
+    ansatz = TwoLocal(n, 'ry', 'cz', reps=3, entanglement='linear', flatten=True)
+    vqe = SamplingVQE(sampler=_sampler(), ansatz=ansatz, optimizer=SLSQP())
+    return MinimumEigenOptimizer(vqe)
+
+
 def optimize_with_qaoa(n, returns, covariance_matrix, risk_factor):
     """
     Portfolio optimization using QAOA (Quantum Approximate Optimization Algorithm)
     Suitable for large portfolios (20+ stocks) with complex constraints
     """
+    # Binary variables (qubits) per asset for the discretized weights
+    # Using 4 bits per asset gives 16 possible weight levels (0-15)
+    bits_per_asset = 4
+    
     if not QUANTUM_AVAILABLE:
         print("QAOA not available, falling back to MPT", file=sys.stderr)
         return optimize_with_modern_portfolio_theory(n, returns, covariance_matrix, risk_factor)
+    if n * bits_per_asset > QUANTUM_MAX_QUBITS:
+        print(f"QAOA needs {n * bits_per_asset} qubits (max {QUANTUM_MAX_QUBITS}), falling back to MPT", file=sys.stderr)
+        return optimize_with_modern_portfolio_theory(n, returns, covariance_matrix, risk_factor)
+    
+    # Single stock: nothing to optimize, skip building the QUBO and circuit
+    if n == 1:
+        return np.array([1.0])
     
     try:
         print("Running QAOA optimization...", file=sys.stderr)
-        start_time = time.time()
-        
-        # Create quadratic program for portfolio optimization
-        qp = QuadraticProgram('portfolio')
-        
-        # Add binary variables for each asset (discretized weights)
-        # Using 4 bits per asset gives 16 possible weight levels (0-15)
-        bits_per_asset = 4
-        max_weight_value = 2**bits_per_asset - 1
-        
-        # Add variables
-        for i in range(n):
-            for bit in range(bits_per_asset):
-                qp.binary_var(f'x_{i}_{bit}')
+        start_time = time.perf_counter()
         
-        # Objective: Maximize return - risk_factor * variance
-        # Simplified objective for quantum optimization
-        linear_coeffs = {}
-        quadratic_coeffs = {}
+        bv = _bit_values(bits_per_asset)
         
-        # Linear terms (returns)
-        for i in range(n):
-            for bit in range(bits_per_asset):
-                bit_value = 2**bit / max_weight_value
-                var_name = f'x_{i}_{bit}'
-                linear_coeffs[var_name] = -returns[i] * bit_value  # Negative for minimization
-        
-        # Quadratic terms (risk penalty)
-        risk_penalty = risk_factor * 2.0
-        for i in range(n):
-            for j in range(n):
-                for bit_i in range(bits_per_asset):
-                    for bit_j in range(bits_per_asset):
-                        bit_value_i = 2**bit_i / max_weight_value
-                        bit_value_j = 2**bit_j / max_weight_value
-                        var_i = f'x_{i}_{bit_i}'
-                        var_j = f'x_{j}_{bit_j}'
-                        coeff = risk_penalty * covariance_matrix[i, j] * bit_value_i * bit_value_j
-                        quadratic_coeffs[(var_i, var_j)] = coeff
-        
-        # Set objective
-        qp.minimize(linear=linear_coeffs, quadratic=quadratic_coeffs)
-        
-        # Convert to QUBO
-        converter = QuadraticProgramToQubo()
-        qubo = converter.convert(qp)
-        
-        # Setup QAOA
-        sampler = Sampler()
-        qaoa = QAOA(sampler=sampler, optimizer=COBYLA(), reps=2)
-        
-        # Run optimization
-        optimizer = MinimumEigenOptimizer(qaoa)
-        result = optimizer.solve(qubo)
+        # Small or separable QUBO: solve it exactly on the CPU instead of
+        # paying for circuit construction and sampling
+        linear, quadratic = _qubo_coefficients(returns, covariance_matrix, risk_factor, bits_per_asset)
+        bits = _solve_small_qubo(linear, quadratic)
+        if bits is None:
+            qubo = _portfolio_qubo(linear, quadratic)
+            
+            # Setup QAOA, warm-started from the best depth-1 grid angles so COBYLA
+            # only refines locally (initial trust region of one grid cell; the cost
+            # operator is normalized so beta and gamma share the grid step).
+            # The ansatz is built explicitly with flatten=True (QAOA's own ansatz keeps
+            # nested gates, which makes parameter binding slow on every evaluation)
+            reps = 2
+            grid_size = 16
+            initial_point, scale = _qaoa_initial_point(qubo, reps, grid_size)
+            cost_operator, _ = qubo.to_ising()
+            ansatz = QAOAAnsatz(cost_operator / scale, reps=reps, flatten=True)
+            qaoa = SamplingVQE(
+                sampler=_sampler(),
+                ansatz=ansatz,
+                optimizer=COBYLA(rhobeg=np.pi / grid_size),
+                initial_point=initial_point
+            )
+            
+            # Run optimization
+            optimizer = MinimumEigenOptimizer(qaoa)
+            result = optimizer.solve(qubo)
+            bits = np.asarray(result.x) > 0.5
+        else:
+            print(f"QUBO solved exactly ({linear.size} bits), skipping QAOA circuit", file=sys.stderr)
         
-        # Extract weights from result
-        weights = np.zeros(n)
-        for i in range(n):
-            for bit in range(bits_per_asset):
-                var_name = f'x_{i}_{bit}'
-                if var_name in result.variables_dict:
-                    if result.variables_dict[var_name] > 0.5:
-                        weights[i] += 2**bit / max_weight_value
+        # Extract weights (solution bits follow the (asset, bit) variable order)
+        weights = bits.reshape(n, bits_per_asset) @ bv
         
         # Normalize weights
         if weights.sum() > 0:
@@ -793,14 +1112,13 @@ def optimize_with_qaoa(n, returns, covariance_matrix, risk_factor):
         else:
             weights = np.ones(n) / n
         
-        elapsed = time.time() - start_time
+        elapsed = time.perf_counter() - start_time
         print(f"QAOA completed in {elapsed:.2f} seconds", file=sys.stderr)
         
         return weights
         
     except Exception as e:
-        print(f"QAOA optimization failed: {e}", file=sys.stderr)
-        print("Falling back to MPT", file=sys.stderr)
+        print(f"QAOA optimization failed: {e}\nFalling back to MPT", file=sys.stderr)
         return optimize_with_modern_portfolio_theory(n, returns, covariance_matrix, risk_factor)
 
 
@@ -812,74 +1130,56 @@ def optimize_with_vqe(n, returns, covariance_matrix, risk_factor):
     if not QUANTUM_AVAILABLE:
         print("VQE not available, falling back to MPT", file=sys.stderr)
         return optimize_with_modern_portfolio_theory(n, returns, covariance_matrix, risk_factor)
+    if n > QUANTUM_MAX_QUBITS:
+        print(f"VQE needs {n} qubits (max {QUANTUM_MAX_QUBITS}), falling back to MPT", file=sys.stderr)
+        return optimize_with_modern_portfolio_theory(n, returns, covariance_matrix, risk_factor)
+    
+    # Single stock: nothing to optimize, skip building the QUBO and circuit
+    if n == 1:
+        return np.array([1.0])
     
     try:
         print("Running VQE optimization...", file=sys.stderr)
-        start_time = time.time()
-        
-        # Create simplified problem for VQE (using fewer qubits)
-        # Each qubit represents whether to include an asset
-        qp = QuadraticProgram('portfolio_vqe')
-        
-        # Add binary variables
-        for i in range(n):
-            qp.binary_var(f'x_{i}')
-        
-        # Simplified objective
-        linear_coeffs = {}
-        quadratic_coeffs = {}
-        
-        # Returns (negative for minimization)
-        for i in range(n):
-            linear_coeffs[f'x_{i}'] = -returns[i]
-        
-        # Risk penalty
-        risk_penalty = risk_factor * 2.0
-        for i in range(n):
-            for j in range(n):
-                quadratic_coeffs[(f'x_{i}', f'x_{j}')] = risk_penalty * covariance_matrix[i, j]
-        
-        qp.minimize(linear=linear_coeffs, quadratic=quadratic_coeffs)
-        
-        # Convert to QUBO
-        converter = QuadraticProgramToQubo()
-        qubo = converter.convert(qp)
-        
-        # Setup VQE with TwoLocal ansatz
-        ansatz = TwoLocal(n, 'ry', 'cz', reps=3, entanglement='linear')
-        sampler = Sampler()
-        vqe = VQE(sampler=sampler, ansatz=ansatz, optimizer=SLSQP())
-        
-        # Run optimization
-        optimizer = MinimumEigenOptimizer(vqe)
-        result = optimizer.solve(qubo)
-        
-        # Extract weights (binary decision + equal distribution)
-        weights = np.zeros(n)
-        selected = []
-        for i in range(n):
-            var_name = f'x_{i}'
-            if var_name in result.variables_dict and result.variables_dict[var_name] > 0.5:
-                selected.append(i)
+        start_time = time.perf_counter()
+        
+        # Simplified problem for VQE (using fewer qubits): one bit per asset,
+        # so each qubit represents whether to include an asset
+        linear, quadratic = _qubo_coefficients(returns, covariance_matrix, risk_factor, 1)
+        selected = _solve_small_qubo(linear, quadratic)
+        if selected is None:
+            qubo = _portfolio_qubo(linear, quadratic)
+            
+            # Run optimization (VQE with a flattened TwoLocal ansatz, reused per size)
+            result = _vqe_optimizer(n).solve(qubo)
+            selected = np.asarray(result.x) > 0.5
+        else:
+            print(f"QUBO solved exactly ({linear.size} bits), skipping VQE circuit", file=sys.stderr)
         
-        # Distribute equally among selected assets
-        if selected:
-            for i in selected:
-                weights[i] = 1.0 / len(selected)
+        # Extract weights (binary decision + equal distribution among selected assets)
+        if selected.any():
+            weights = selected / selected.sum()
         else:
             weights = np.ones(n) / n
         
-        elapsed = time.time() - start_time
+        elapsed = time.perf_counter() - start_time
         print(f"VQE completed in {elapsed:.2f} seconds", file=sys.stderr)
         
         return weights
         
     except Exception as e:
-        print(f"VQE optimization failed: {e}", file=sys.stderr)
-        print("Falling back to MPT", file=sys.stderr)
+        print(f"VQE optimization failed: {e}\nFalling back to MPT", file=sys.stderr)
         return optimize_with_modern_portfolio_theory(n, returns, covariance_matrix, risk_factor)
 
 
+def _json_default(obj):
+    """json.dumps fallback for NumPy scalars/arrays that reach the result dict"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
 def main():
     if len(sys.argv) < 3:
         print("Usage: optimize_portfolio.py <input_json_file> <session_id> [method] [use_real_data]", file=sys.stderr)
@@ -913,6 +1213,22 @@ def main():
         # Fetch historical data and calculate statistics
         returns, covariance_matrix = fetch_historical_data(stocks, use_real_data=use_real_data_from_request)
         
+        # Backtesting only needs the stock list and is network-bound: run it in a
+        # background thread while the optimization below runs. Started after the
+        # fetch above because concurrent yf.download calls share global state.
+        # Daemon thread, so an error exit below does not wait for the download.
+        backtest_thread = None
+        backtest_output = {}
+        if use_real_data:
+            print("Running backtesting...", file=sys.stderr)
+            backtest_thread = threading.Thread(
+                target=lambda: backtest_output.update(
+                    results=backtest_optimization(stocks, periods=['3mo', '6mo', '1y'])
+                ),
+                daemon=True
+            )
+            backtest_thread.start()
+        
         # Build optimization problem
         risk_factor = target_risk / 10.0  # Normalize to [0, 1]
         n, returns, covariance_matrix, risk_factor = build_portfolio_optimization_problem(
@@ -938,21 +1254,21 @@ def main():
         
         # Calculate current portfolio weights
         # Support both quantity/currentPrice and investmentAmount formats
+        n_stocks = len(stocks)
         if 'quantity' in stocks[0] and 'currentPrice' in stocks[0]:
-            total_current_value = sum(stock['quantity'] * stock['currentPrice'] for stock in stocks)
-            current_weights = np.array([
-                (stock['quantity'] * stock['currentPrice']) / total_current_value 
-                if total_current_value > 0 else 1.0 / len(stocks)
-                for stock in stocks
-            ])
+            quantities = np.fromiter((stock['quantity'] for stock in stocks), dtype=np.float64, count=n_stocks)
+            prices = np.fromiter((stock['currentPrice'] for stock in stocks), dtype=np.float64, count=n_stocks)
+            current_values = quantities * prices
         else:
             # Use investmentAmount
-            total_investment_value = sum(stock.get('investmentAmount', 0) for stock in stocks)
-            current_weights = np.array([
-                stock.get('investmentAmount', 0) / total_investment_value
-                if total_investment_value > 0 else 1.0 / len(stocks)
-                for stock in stocks
-            ])
+            current_values = np.fromiter(
+                (stock.get('investmentAmount', 0) for stock in stocks), dtype=np.float64, count=n_stocks
+            )
+        total_current_value = current_values.sum()
+        if total_current_value > 0:
+            current_weights = current_values / total_current_value
+        else:
+            current_weights = np.full(n_stocks, 1.0 / n_stocks)
         
         # Generate optimization reason
         optimization_reason = generate_optimization_reason(
@@ -970,11 +1286,10 @@ def main():
         # Calculate current portfolio metrics
         current_metrics = calculate_portfolio_metrics(returns, covariance_matrix, current_weights)
         
-        # Run backtesting if using real data
-        backtest_results = []
-        if use_real_data:
-            print("Running backtesting...", file=sys.stderr)
-            backtest_results = backtest_optimization(stocks, periods=['3mo', '6mo', '1y'])
+        # Collect backtesting results (started above) if using real data
+        if backtest_thread is not None:
+            backtest_thread.join()
+        backtest_results = backtest_output.get('results', [])
         
         # Prepare result
         result = {
@@ -1005,14 +1320,16 @@ def main():
             }
         }
         
-        # Output result as JSON
-        print(json.dumps(result))
+        # Output result as compact JSON
+        print(json.dumps(result, separators=(',', ':'), default=_json_default))
         
     except Exception as e:
-        import traceback
         print(f"Error occurred: {str(e)}", file=sys.stderr)
-        print(f"Traceback:", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
+        # Full traceback only when debugging (set DEBUG=1)
+        if os.environ.get('DEBUG'):
+            import traceback
+            print(f"Traceback:", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
         error_result = {
             'error': str(e),
             'allocation': {},
@@ -1022,7 +1339,7 @@ def main():
             'visualizationPath': '',
             'additionalMetrics': {}
         }
-        print(json.dumps(error_result))
+        print(json.dumps(error_result, separators=(',', ':'), default=_json_default))
         sys.exit(1)
 
 